@@ -1,43 +1,165 @@
 #!/usr/bin/env python3
 
-from astropy import units as u
-from astropy.coordinates import SkyCoord
+import math
+import os
+import tempfile
 from astroquery.gaia import Gaia
+import pandas as pd
 import matplotlib.pyplot as plt
+from matplotlib.lines import Line2D
 import numpy as np
 
-def nearby_stars(max_distance):
-	# Convert max_distance to parsecs
-	max_distance_pc = max_distance.to(u.pc).value
+try:
+	from numba import njit, prange, types
+except ImportError:
+	njit = None
+
+try:
+	import numexpr as ne
+except ImportError:
+	ne = None
+
+# Upper bound on the number of stars returned by a single Gaia query; the TOP clause
+# is what limits the result, so astroquery's own row limit is switched off
+MAX_STARS = 100000
+Gaia.ROW_LIMIT = -1
+
+# Parsecs per light-year; distances are plain floats, so units only appear in labels
+PC_PER_LY = 0.30660139378555057
+
+# Above this many stars, draw a rasterised density image instead of individual markers
+DATASHADER_THRESHOLD = 50000
+
+# Above this many stars, the star scatter is drawn as a single raster image instead of vector markers
+RASTERIZE_THRESHOLD = 10000
+
+# Star colours are quantised to this many coolwarm shades so the renderer sees few distinct colours
+STAR_COLOR_LEVELS = 32
+STAR_COLOR_LUT = plt.cm.coolwarm(np.linspace(0, 1, STAR_COLOR_LEVELS)).astype(np.float32)
+
+if njit is not None:
+	# The explicit signature compiles the kernel at import (and caches it on disk),
+	# so the first plot doesn't pay the JIT cost. Inputs are typed read-only so the
+	# arrays pandas hands out can be passed without a copy. NumPy's error model drops
+	# the zero-division check on the parallax, which otherwise keeps LLVM from
+	# vectorising the loop (and its trig, through SVML when Numba finds it).
+	_f32_in = types.Array(types.float32, 1, 'C', readonly=True)
+	
+	@njit(types.void(_f32_in, _f32_in, _f32_in, types.float32[:, ::1], types.float32[::1]),
+		parallel=True, fastmath=True, error_model='numpy', cache=True)
+	def _radec_plx_to_xyz(ra_deg, dec_deg, plx_mas, xyz, dist):
+		k = np.float32(math.pi / 180.0)
+		for i in prange(ra_deg.size):
+			d = np.float32(1000.0) / plx_mas[i]
+			cd = math.cos(dec_deg[i] * k)
+			xyz[i, 0] = d * cd * math.cos(ra_deg[i] * k)
+			xyz[i, 1] = d * cd * math.sin(ra_deg[i] * k)
+			xyz[i, 2] = d * math.sin(dec_deg[i] * k)
+			dist[i] = d
+
+def _star_arrays(result_table):
+	# Copy the parallax, ra and dec columns into one contiguous float32 (3, N) block and
+	# drop rows without a usable parallax with a single mask over all three rows
+	block = np.empty((3, len(result_table)), dtype=np.float32)
+	block[0] = result_table['parallax']
+	block[1] = result_table['ra']
+	block[2] = result_table['dec']
+	valid = block[0] > 0
+	if not valid.all():
+		block = block[:, valid]
+	return block[0], block[1], block[2]
+
+def _project_stars(ra_deg, dec_deg, plx_mas):
+	# Return an (N, 3) array of heliocentric x, y, z and the distances, all in parsecs, for
+	# positions in degrees and parallaxes in milliarcseconds. Inputs are coerced to contiguous
+	# float32 (a no-op for the rows _star_arrays returns; Matplotlib renders in float32 anyway)
+	# and stay float32 throughout; units only appear in the labels.
+	ra_deg = np.ascontiguousarray(ra_deg, dtype=np.float32)
+	dec_deg = np.ascontiguousarray(dec_deg, dtype=np.float32)
+	plx_mas = np.ascontiguousarray(plx_mas, dtype=np.float32)
+	
+	if njit is not None:
+		xyz = np.empty((plx_mas.size, 3), dtype=np.float32)
+		distances = np.empty_like(plx_mas)
+		_radec_plx_to_xyz(ra_deg, dec_deg, plx_mas, xyz, distances)
+		return xyz, distances
+	
+	distances = 1000.0 / plx_mas
 	
-	# Query Gaia DR2 for nearby stars within the specified distance range
+	# Without Numba, prefer numexpr: its vectorised trig (MKL VML when available) and
+	# fused products avoid NumPy's per-element libm calls and most temporaries. The
+	# degree-to-radian factor is folded into the trig arguments, so no radian arrays
+	# are allocated.
+	if ne is not None:
+		k = np.float32(math.pi / 180.0)
+		xyz = np.empty((plx_mas.size, 3), dtype=np.float32)
+		d_cos_dec = ne.evaluate('distances * cos(dec_deg * k)')
+		xyz[:, 0] = ne.evaluate('d_cos_dec * cos(ra_deg * k)')
+		xyz[:, 1] = ne.evaluate('d_cos_dec * sin(ra_deg * k)')
+		xyz[:, 2] = ne.evaluate('distances * sin(dec_deg * k)')
+		return xyz, distances
+	
+	# Otherwise fall back to NumPy: scale the unit direction vectors by the distances
+	# in a single broadcast multiply
+	ra_rad = np.radians(ra_deg)
+	dec_rad = np.radians(dec_deg)
+	cos_dec = np.cos(dec_rad)
+	unit_vectors = np.stack([cos_dec * np.cos(ra_rad), cos_dec * np.sin(ra_rad), np.sin(dec_rad)], axis=1)
+	xyz = unit_vectors * distances[:, None]
+	return xyz, distances
+
+def _shade_stars(ax, x, y, distances, max_distance_pc):
+	# Aggregate the stars into a single image of mean distance per pixel so
+	# Matplotlib draws one bitmap instead of building a path per point
+	try:
+		import datashader as ds
+	except ImportError:
+		return None
+	
+	extent = (-max_distance_pc, max_distance_pc, -max_distance_pc, max_distance_pc)
+	canvas = ds.Canvas(plot_width=1024, plot_height=1024, x_range=extent[:2], y_range=extent[2:])
+	agg = canvas.points(pd.DataFrame({'x': x, 'y': y, 'd': distances}), 'x', 'y', ds.mean('d'))
+	
+	# Nearer stars are red and farther ones blue, matching the scatter colouring
+	return ax.imshow(agg.values, origin='lower', extent=extent, cmap='coolwarm_r',
+		vmin=distances.min(), vmax=distances.max(), interpolation='nearest', alpha=0.8, zorder=5)
+
+def nearby_stars(max_distance_ly):
+	# Convert max_distance_ly to parsecs
+	max_distance_pc = max_distance_ly * PC_PER_LY
+	
+	# Query Gaia DR3 for the nearest stars within the specified distance range.
+	# Parallax is in milliarcseconds, so the cut-off is 1000 / distance in parsecs.
+	# Filtering, sorting and the row limit all happen server-side.
+	min_parallax = 1000.0 / max_distance_pc
 	query = f"""
-	SELECT source_id, ra, dec, parallax
-	FROM gaiadr2.gaia_source
-	WHERE parallax >= {1 / max_distance_pc} AND parallax IS NOT NULL
+	SELECT TOP {MAX_STARS} ra, dec, parallax
+	FROM gaiadr3.gaia_source
+	WHERE parallax > {min_parallax}
+	ORDER BY parallax DESC
 	"""
-	job = Gaia.launch_job(query)
-	result_table = job.get_results()
+	
+	# Run it as an asynchronous job (no synchronous row cap) and download the result
+	# as CSV, which pandas parses much faster than astropy's VOTable reader
+	with tempfile.TemporaryDirectory() as download_dir:
+		job = Gaia.launch_job_async(query, output_format='csv', dump_to_file=True,
+			output_file=os.path.join(download_dir, 'nearby_stars.csv'))
+		result_table = pd.read_csv(job.outputFile, usecols=['ra', 'dec', 'parallax'], dtype=np.float32)
 	
 	if len(result_table) == 0:
 		print("No nearby stars found within the specified distance.")
 		return
 	
-	# Calculate distances in parsecs using parallax
-	parallaxes = result_table['parallax'].data
-	valid_parallaxes = parallaxes > 0
-	distances = (1 / parallaxes[valid_parallaxes]) * u.pc
-	
-	# Convert right ascension and declination to radians
-	ra_rad = np.radians(result_table['ra'][valid_parallaxes].data)
-	dec_rad = np.radians(result_table['dec'][valid_parallaxes].data)
-	
-	# Convert distances and angles to Cartesian coordinates
-	x = distances * np.cos(dec_rad) * np.cos(ra_rad)
-	y = distances * np.cos(dec_rad) * np.sin(ra_rad)
+	# Calculate distances in parsecs using parallax and convert them and the sky
+	# positions to Cartesian coordinates. The plot is a view onto the x-y plane,
+	# so z is kept but not drawn.
+	parallaxes, ra_deg, dec_deg = _star_arrays(result_table)
+	xyz, distances = _project_stars(ra_deg, dec_deg, parallaxes)
+	x = xyz[:, 0]
+	y = xyz[:, 1]
 	
 	# Create a plot with a dark background
-	fig, ax = plt.subplots(figsize=(10, 10), facecolor='black')
+	fig, ax = plt.subplots(figsize=(10, 10), dpi=100, facecolor='black')
 	ax.set_facecolor('black')
 	
 	# Plot the Sun at the center with a glowing effect
@@ -49,19 +171,36 @@ def nearby_stars(max_distance):
 	# Plot the nearby stars with varying sizes based on distance
 	max_star_size = 100
 	min_star_size = 10
-	star_sizes = (1 - (distances - distances.min()) / (distances.max() - distances.min())) * (max_star_size - min_star_size) + min_star_size
-	star_colors = plt.cm.coolwarm(1 - (distances - distances.min()) / (distances.max() - distances.min()))
-	star_plot = ax.scatter(x, y, c=star_colors, s=star_sizes, alpha=0.8, zorder=5, label='Nearby Stars')
+	
+	# Normalise the distances once (nearest = 1, farthest = 0) and share it between sizes and colours
+	min_distance = distances.min()
+	distance_span = (distances.max() - min_distance) or 1.0
+	closeness = 1.0 - (distances - min_distance) * (1.0 / distance_span)
+	star_sizes = closeness * (max_star_size - min_star_size) + min_star_size
+	color_index = np.clip((closeness * STAR_COLOR_LEVELS).astype(np.int32), 0, STAR_COLOR_LEVELS - 1)
+	star_colors = STAR_COLOR_LUT[color_index]
+	
+	star_plot = None
+	if len(x) > DATASHADER_THRESHOLD:
+		star_plot = _shade_stars(ax, x, y, distances, max_distance_pc)
+	if star_plot is None:
+		# Edgeless markers skip stroking an outline around every star
+		star_plot = ax.scatter(x, y, c=star_colors, s=star_sizes, alpha=0.8, zorder=5, label='Nearby Stars',
+			marker='o', linewidths=0, edgecolors='none', rasterized=len(x) > RASTERIZE_THRESHOLD)
+		star_handle = star_plot
+	else:
+		# Images can't appear in a legend, so stand in a marker for them
+		star_handle = Line2D([], [], linestyle='none', marker='o', color=plt.cm.coolwarm(0.5), label='Nearby Stars')
 	
 	# Set the limits and labels for the plot
-	ax.set_xlim(-max_distance.to(u.pc).value, max_distance.to(u.pc).value)
-	ax.set_ylim(-max_distance.to(u.pc).value, max_distance.to(u.pc).value)
+	ax.set_xlim(-max_distance_pc, max_distance_pc)
+	ax.set_ylim(-max_distance_pc, max_distance_pc)
 	ax.set_xlabel('Distance (parsecs)', color='white')
 	ax.set_ylabel('Distance (parsecs)', color='white')
-	ax.set_title(f'Nearby Stars within {max_distance:.2f}', color='white', fontsize=16)
+	ax.set_title(f'Nearby Stars within {max_distance_ly:.2f} lyr ({max_distance_pc:.2f} pc)', color='white', fontsize=16)
 	
 	# Create a legend
-	legend = ax.legend(handles=[sun_plot, star_plot], fontsize=12, loc='upper right', facecolor='black', edgecolor='white')
+	legend = ax.legend(handles=[sun_plot, star_handle], fontsize=12, loc='upper right', facecolor='black', edgecolor='white')
 	for text in legend.get_texts():
 		text.set_color('white')
 		
@@ -83,6 +222,5 @@ def nearby_stars(max_distance):
 	
 # Get user input for the maximum distance
 max_distance_input = float(input("Enter the maximum distance in light-years: "))
-max_distance = max_distance_input * u.lyr
 
-nearby_stars(max_distance)
\ No newline at end of file
+nearby_stars(max_distance_input)
\ No newline at end of file
@@ -1,13 +1,196 @@
 #!/usr/bin/env python3
 
+import math
+import os
+import shutil
 import sys
-from astropy import units as u
-from astroquery.gaia import Gaia
-import matplotlib.pyplot as plt
+import tempfile
+from functools import lru_cache
+from matplotlib import colormaps
+from matplotlib.artist import setp
+from matplotlib.colors import ListedColormap
+from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+from matplotlib.patches import Circle
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 import numpy as np
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
 from PyQt5.QtWidgets import QApplication, QMainWindow, QLabel, QLineEdit, QPushButton, QVBoxLayout, QWidget
 
+try:
+	from numba import njit, prange, types
+except ImportError:
+	njit = None
+
+try:
+	import numexpr as ne
+except ImportError:
+	ne = None
+
+# astroquery and pandas are imported on the first query (on the worker thread) so the
+# window appears without waiting for them, and pyplot is never loaded at all
+
+# Upper bound on the number of stars returned by a single Gaia query
+MAX_STARS = 100000
+
+# Parsecs per light-year; distances are plain floats, so units only appear in labels
+PC_PER_LY = 0.30660139378555057
+
+# Above this many stars, draw a rasterised density image instead of individual markers
+DATASHADER_THRESHOLD = 50000
+
+# Above this many stars, the star scatter is drawn as a single raster image instead of vector markers
+RASTERIZE_THRESHOLD = 10000
+
+# From this many stars on, the GUI renders on the GPU through vispy when it's installed
+GPU_THRESHOLD = 10000
+
+# Star colours are quantised to this many coolwarm shades so the renderer sees few distinct colours
+STAR_COLOR_LEVELS = 32
+STAR_COLOR_LUT = colormaps['coolwarm'](np.linspace(0, 1, STAR_COLOR_LEVELS)).astype(np.float32)
+
+if njit is not None:
+	# The explicit signature compiles the kernel at import (and caches it on disk),
+	# so the first plot doesn't pay the JIT cost. Inputs are typed read-only so the
+	# arrays pandas hands out can be passed without a copy. NumPy's error model drops
+	# the zero-division check on the parallax, which otherwise keeps LLVM from
+	# vectorising the loop (and its trig, through SVML when Numba finds it).
+	_f32_in = types.Array(types.float32, 1, 'C', readonly=True)
+	
+	@njit(types.void(_f32_in, _f32_in, _f32_in, types.float32[:, ::1], types.float32[::1]),
+		parallel=True, fastmath=True, error_model='numpy', cache=True)
+	def _radec_plx_to_xyz(ra_deg, dec_deg, plx_mas, xyz, dist):
+		k = np.float32(math.pi / 180.0)
+		for i in prange(ra_deg.size):
+			d = np.float32(1000.0) / plx_mas[i]
+			cd = math.cos(dec_deg[i] * k)
+			xyz[i, 0] = d * cd * math.cos(ra_deg[i] * k)
+			xyz[i, 1] = d * cd * math.sin(ra_deg[i] * k)
+			xyz[i, 2] = d * math.sin(dec_deg[i] * k)
+			dist[i] = d
+
+def _star_arrays(result_table):
+	# Copy the parallax, ra and dec columns into one contiguous float32 (3, N) block and
+	# drop rows without a usable parallax with a single mask over all three rows
+	block = np.empty((3, len(result_table)), dtype=np.float32)
+	block[0] = result_table['parallax']
+	block[1] = result_table['ra']
+	block[2] = result_table['dec']
+	valid = block[0] > 0
+	if not valid.all():
+		block = block[:, valid]
+	return block[0], block[1], block[2]
+
+def _project_stars(ra_deg, dec_deg, plx_mas):
+	# Return an (N, 3) array of heliocentric x, y, z and the distances, all in parsecs, for
+	# positions in degrees and parallaxes in milliarcseconds. Inputs are coerced to contiguous
+	# float32 (a no-op for the rows _star_arrays returns; Matplotlib renders in float32 anyway)
+	# and stay float32 throughout; units only appear in the labels.
+	ra_deg = np.ascontiguousarray(ra_deg, dtype=np.float32)
+	dec_deg = np.ascontiguousarray(dec_deg, dtype=np.float32)
+	plx_mas = np.ascontiguousarray(plx_mas, dtype=np.float32)
+	
+	if njit is not None:
+		xyz = np.empty((plx_mas.size, 3), dtype=np.float32)
+		distances = np.empty_like(plx_mas)
+		_radec_plx_to_xyz(ra_deg, dec_deg, plx_mas, xyz, distances)
+		return xyz, distances
+	
+	distances = 1000.0 / plx_mas
+	
+	# Without Numba, prefer numexpr: its vectorised trig (MKL VML when available) and
+	# fused products avoid NumPy's per-element libm calls and most temporaries. The
+	# degree-to-radian factor is folded into the trig arguments, so no radian arrays
+	# are allocated.
+	if ne is not None:
+		k = np.float32(math.pi / 180.0)
+		xyz = np.empty((plx_mas.size, 3), dtype=np.float32)
+		d_cos_dec = ne.evaluate('distances * cos(dec_deg * k)')
+		xyz[:, 0] = ne.evaluate('d_cos_dec * cos(ra_deg * k)')
+		xyz[:, 1] = ne.evaluate('d_cos_dec * sin(ra_deg * k)')
+		xyz[:, 2] = ne.evaluate('distances * sin(dec_deg * k)')
+		return xyz, distances
+	
+	# Otherwise fall back to NumPy: scale the unit direction vectors by the distances
+	# in a single broadcast multiply
+	ra_rad = np.radians(ra_deg)
+	dec_rad = np.radians(dec_deg)
+	cos_dec = np.cos(dec_rad)
+	unit_vectors = np.stack([cos_dec * np.cos(ra_rad), cos_dec * np.sin(ra_rad), np.sin(dec_rad)], axis=1)
+	xyz = unit_vectors * distances[:, None]
+	return xyz, distances
+
+# Query results are persisted here so restarts don't have to hit Gaia again
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'star_distance')
+
+@lru_cache(maxsize=32)
+def _query_parallax(min_parallax):
+	import pandas as pd
+	
+	# Load a previous result for this cut-off from disk if there is one
+	cache_path = os.path.join(CACHE_DIR, f'gaiadr3_top{MAX_STARS}_plx{min_parallax:.3f}.csv')
+	if os.path.exists(cache_path):
+		return pd.read_csv(cache_path, usecols=['ra', 'dec', 'parallax'], dtype=np.float32)
+	
+	# Query Gaia DR3 for the nearest stars above the parallax cut-off.
+	# Filtering, sorting and the row limit all happen server-side.
+	query = f"""
+	SELECT TOP {MAX_STARS} ra, dec, parallax
+	FROM gaiadr3.gaia_source
+	WHERE parallax > {min_parallax}
+	ORDER BY parallax DESC
+	"""
+	
+	# Run it as an asynchronous job (no synchronous row cap) and download the result
+	# as CSV, which pandas parses much faster than astropy's VOTable reader. The TOP
+	# clause is what limits the result, so astroquery's own row limit is switched off.
+	from astroquery.gaia import Gaia
+	Gaia.ROW_LIMIT = -1
+	with tempfile.TemporaryDirectory() as download_dir:
+		job = Gaia.launch_job_async(query, output_format='csv', dump_to_file=True,
+			output_file=os.path.join(download_dir, 'nearby_stars.csv'))
+		result_table = pd.read_csv(job.outputFile, usecols=['ra', 'dec', 'parallax'], dtype=np.float32)
+		
+		# The downloaded CSV becomes the disk cache; a failed cache write shouldn't stop the plot
+		try:
+			os.makedirs(CACHE_DIR, exist_ok=True)
+			shutil.move(job.outputFile, cache_path)
+		except OSError:
+			pass
+	return result_table
+
+def _aggregate_stars(x, y, distances, max_distance_pc):
+	# Aggregate the stars into a single image of mean distance per pixel so
+	# Matplotlib draws one bitmap instead of building a path per point
+	try:
+		import datashader as ds
+	except ImportError:
+		return None
+	import pandas as pd
+	
+	canvas = ds.Canvas(plot_width=1024, plot_height=1024,
+		x_range=(-max_distance_pc, max_distance_pc), y_range=(-max_distance_pc, max_distance_pc))
+	agg = canvas.points(pd.DataFrame({'x': x, 'y': y, 'd': distances}), 'x', 'y', ds.mean('d'))
+	return agg.values
+
+class GaiaWorker(QObject):
+	# Runs a star table fetch off the Qt main thread and reports back through signals
+	finished = pyqtSignal(object)
+	failed = pyqtSignal(str)
+	
+	def __init__(self, fetch, min_parallax):
+		super().__init__()
+		self._fetch = fetch
+		self._min_parallax = min_parallax
+		
+	def run(self):
+		try:
+			result_table = self._fetch(self._min_parallax)
+		except Exception as exc:
+			self.failed.emit(str(exc))
+			return
+		self.finished.emit(result_table)
+		
 class NearbyStarsApp(QMainWindow):
 	def __init__(self):
 		super().__init__()
@@ -15,8 +198,10 @@ class NearbyStarsApp(QMainWindow):
 		self.setGeometry(100, 100, 800, 600)
 		
 		# Create a figure and canvas for the plot
-		self.fig, self.ax = plt.subplots(figsize=(8, 8), facecolor='black')
+		self.fig = Figure(figsize=(8, 8), dpi=100, facecolor='black')
+		self.ax = self.fig.add_subplot(111)
 		self.canvas = FigureCanvas(self.fig)
+		self._create_plot_artists()
 		
 		# Create GUI components
 		self.label = QLabel('Enter the maximum distance in light-years:')
@@ -27,6 +212,7 @@ class NearbyStarsApp(QMainWindow):
 		# Create layout and add components
 		layout = QVBoxLayout()
 		layout.addWidget(self.canvas)
+		self._create_gpu_canvas(layout)
 		layout.addWidget(self.label)
 		layout.addWidget(self.input_field)
 		layout.addWidget(self.plot_button)
@@ -36,84 +222,183 @@ class NearbyStarsApp(QMainWindow):
 		central_widget.setLayout(layout)
 		self.setCentralWidget(central_widget)
 		
-	def plot_nearby_stars(self):
-		max_distance_input = float(self.input_field.text())
-		max_distance = max_distance_input * u.lyr
-		
-		# Query Gaia DR2 for nearby stars within the specified distance range
-		max_distance_pc = max_distance.to(u.pc).value
-		query = f"""
-		SELECT source_id, ra, dec, parallax
-		FROM gaiadr2.gaia_source
-		WHERE parallax >= {1 / max_distance_pc} AND parallax IS NOT NULL
-		"""
-		job = Gaia.launch_job(query)
-		result_table = job.get_results()
+		# Widest query result so far, reused for any smaller distance
+		self._cached_table = None
+		self._cached_min_parallax = None
 		
-		if len(result_table) == 0:
-			print("No nearby stars found within the specified distance.")
-			return
+	def _nearby_star_table(self, min_parallax):
+		# Larger parallax cut-off means a smaller radius, so the cached table already
+		# holds every star needed (rows are sorted by parallax, so TOP N stays valid)
+		if self._cached_table is None or min_parallax < self._cached_min_parallax:
+			# Round the cut-off down so similar distances share a cache entry
+			rounded_min_parallax = np.floor(min_parallax * 1000) / 1000
+			self._cached_table = _query_parallax(rounded_min_parallax)
+			self._cached_min_parallax = rounded_min_parallax
 		
-		# Recreate the figure and axes to ensure it's cleared
-		self.fig.clf()  # Clear the figure completely
-		self.ax = self.fig.add_subplot(111, facecolor='black')  # Recreate the axes on the cleared figure
+		table = self._cached_table
+		return table[table['parallax'] > min_parallax]
 		
+	def _create_gpu_canvas(self, layout):
+		# Optional vispy canvas for large star counts: the vertex data is uploaded once
+		# and pan/zoom then run on the GPU. Without vispy everything stays on Matplotlib.
+		self._gpu_canvas = None
+		try:
+			from vispy import scene
+		except ImportError:
+			return
 		
-		# Calculate distances in parsecs using parallax
-		parallaxes = result_table['parallax'].data
-		valid_parallaxes = parallaxes > 0
-		distances = (1 / parallaxes[valid_parallaxes]) * u.pc
+		self._gpu_canvas = scene.SceneCanvas(app='pyqt5', bgcolor='black')
+		self._gpu_view = self._gpu_canvas.central_widget.add_view()
+		self._gpu_view.camera = scene.PanZoomCamera(aspect=1)
+		self._gpu_stars = scene.visuals.Markers(parent=self._gpu_view.scene)
 		
-		# Convert right ascension and declination to radians
-		ra_rad = np.radians(result_table['ra'][valid_parallaxes].data)
-		dec_rad = np.radians(result_table['dec'][valid_parallaxes].data)
+		# Plot the Sun at the center, drawn above the stars
+		sun = scene.visuals.Markers(parent=self._gpu_view.scene)
+		sun.set_data(pos=np.zeros((1, 2), dtype=np.float32), face_color='yellow', edge_width=0, size=14)
+		sun.order = 1
 		
-		# Convert distances and angles to Cartesian coordinates
-		x = distances * np.cos(dec_rad) * np.cos(ra_rad)
-		y = distances * np.cos(dec_rad) * np.sin(ra_rad)
+		layout.addWidget(self._gpu_canvas.native)
+		self._gpu_canvas.native.hide()
 		
-		# Clear the previous plot
-		self.ax.clear()
+	def _create_plot_artists(self):
+		# Build the plot artists once; each replot only swaps in new data
+		self.ax.set_facecolor('black')
 		
 		# Plot the Sun at the center with a glowing effect
 		sun_size = 200
-		sun_glow = plt.Circle((0, 0), sun_size * 0.7, color='orange', alpha=0.3)
+		sun_glow = Circle((0, 0), sun_size * 0.7, color='orange', alpha=0.3)
 		self.ax.add_artist(sun_glow)
-		sun_plot = self.ax.scatter(0, 0, c='yellow', s=sun_size, label='Sun', zorder=10)
+		self._sun_plot = self.ax.scatter(0, 0, c='yellow', s=sun_size, label='Sun', zorder=10)
 		
-		# Plot the nearby stars with varying sizes based on distance
-		max_star_size = 100
-		min_star_size = 10
-		star_sizes = (1 - (distances - distances.min()) / (distances.max() - distances.min())) * (max_star_size - min_star_size) + min_star_size
-		star_colors = plt.cm.coolwarm(1 - (distances - distances.min()) / (distances.max() - distances.min()))
-		star_plot = self.ax.scatter(x, y, c=star_colors, s=star_sizes, alpha=0.8, zorder=5, label='Nearby Stars')
+		# Nearby stars are coloured by distance with the quantised coolwarm shades (nearest = red).
+		# Large star counts are drawn through the density image instead of the scatter.
+		star_cmap = ListedColormap(STAR_COLOR_LUT[::-1])
+		# Edgeless markers skip stroking an outline around every star
+		self._star_plot = self.ax.scatter([], [], c=[], s=[], cmap=star_cmap, alpha=0.8, zorder=5, label='Nearby Stars',
+			marker='o', linewidths=0, edgecolors='none')
+		self._star_plot.set_clim(0, 1)
+		self._star_image = self.ax.imshow(np.full((1, 1), np.nan), cmap=star_cmap, origin='lower',
+			interpolation='nearest', alpha=0.8, zorder=5, visible=False)
+		
+		# Both star artists can be hidden, so the legend gets its own marker
+		self._star_handle = Line2D([], [], linestyle='none', marker='o', color=colormaps['coolwarm'](0.5), label='Nearby Stars')
+		
+		# Add a colorbar to represent the distance scale
+		self._cbar = self.fig.colorbar(self._star_plot, ax=self.ax, label='Distance (parsecs)')
+		self._cbar.set_label('Distance (parsecs)', color='white', fontsize=12)
+		self._cbar.ax.yaxis.set_tick_params(color='white', labelcolor='white')
+		self._cbar.outline.set_edgecolor('white')
+		setp(self._cbar.ax.get_yticklabels(), color='white')
 		
-		# Set the limits and labels for the plot
-		self.ax.set_xlim(-max_distance.to(u.pc).value, max_distance.to(u.pc).value)
-		self.ax.set_ylim(-max_distance.to(u.pc).value, max_distance.to(u.pc).value)
+		# Set the labels for the plot
 		self.ax.set_xlabel('Distance (parsecs)', color='white')
 		self.ax.set_ylabel('Distance (parsecs)', color='white')
-		self.ax.set_title(f'Nearby Stars within {max_distance:.2f}', color='white', fontsize=16)
 		
 		# Create a legend
-		legend = self.ax.legend(handles=[sun_plot, star_plot], fontsize=12, loc='upper right', facecolor='black', edgecolor='white')
+		legend = self.ax.legend(handles=[self._sun_plot, self._star_handle], fontsize=12, loc='upper right', facecolor='black', edgecolor='white')
 		for text in legend.get_texts():
 			text.set_color('white')
-			
-		# Add a colorbar to represent the distance scale
-		cbar = plt.colorbar(star_plot, ax=self.ax, label='Distance (parsecs)')
-		cbar.set_label('Distance (parsecs)', color='white', fontsize=12)
-		cbar.ax.yaxis.set_tick_params(color='white', labelcolor='white')
-		cbar.outline.set_edgecolor('white')
-		plt.setp(plt.getp(cbar.ax.axes, 'yticklabels'), color='white')
 		
 		# Set the tick labels and grid color
 		self.ax.tick_params(axis='both', which='major', labelsize=12, colors='white')
 		self.ax.tick_params(axis='both', which='minor', labelsize=8, colors='white')
 		self.ax.grid(color='gray', linestyle=':', linewidth=0.5, alpha=0.5)
 		
-		# Redraw the canvas
-		self.canvas.draw()
+	def plot_nearby_stars(self):
+		max_distance_ly = float(self.input_field.text())
+		
+		# Fetch the nearest stars within the specified distance range.
+		# Parallax is in milliarcseconds, so the cut-off is 1000 / distance in parsecs.
+		max_distance_pc = max_distance_ly * PC_PER_LY
+		min_parallax = 1000.0 / max_distance_pc
+		
+		# Run the query on a worker thread so the window stays responsive while it's in flight
+		self._pending_max_distance_ly = max_distance_ly
+		self.plot_button.setEnabled(False)
+		self._query_thread = QThread()
+		self._query_worker = GaiaWorker(self._nearby_star_table, min_parallax)
+		self._query_worker.moveToThread(self._query_thread)
+		self._query_thread.started.connect(self._query_worker.run)
+		self._query_worker.finished.connect(self._on_results)
+		self._query_worker.failed.connect(self._on_query_failed)
+		self._query_worker.finished.connect(self._query_thread.quit)
+		self._query_worker.failed.connect(self._query_thread.quit)
+		self._query_thread.finished.connect(self._query_worker.deleteLater)
+		self._query_thread.finished.connect(self._query_thread.deleteLater)
+		self._query_thread.start()
+		
+	def _on_query_failed(self, message):
+		self.plot_button.setEnabled(True)
+		print(f"Gaia query failed: {message}")
+		
+	def _on_results(self, result_table):
+		self.plot_button.setEnabled(True)
+		max_distance_ly = self._pending_max_distance_ly
+		max_distance_pc = max_distance_ly * PC_PER_LY
+		
+		if len(result_table) == 0:
+			print("No nearby stars found within the specified distance.")
+			return
+		
+		# Calculate distances in parsecs using parallax and convert them and the sky
+		# positions to Cartesian coordinates. The plot is a view onto the x-y plane,
+		# so z is kept but not drawn.
+		parallaxes, ra_deg, dec_deg = _star_arrays(result_table)
+		xyz, distances = _project_stars(ra_deg, dec_deg, parallaxes)
+		x = xyz[:, 0]
+		y = xyz[:, 1]
+		
+		# Plot the nearby stars with varying sizes based on distance
+		max_star_size = 100
+		min_star_size = 10
+		
+		# Normalise the distances once (nearest = 1, farthest = 0) for the sizes;
+		# the colours come from the colormap over the same distance range
+		min_distance = distances.min()
+		distance_span = (distances.max() - min_distance) or 1.0
+		closeness = 1.0 - (distances - min_distance) * (1.0 / distance_span)
+		star_sizes = closeness * (max_star_size - min_star_size) + min_star_size
+		
+		# Large star counts go to the GPU canvas when it's available
+		use_gpu = self._gpu_canvas is not None and len(x) >= GPU_THRESHOLD
+		self.canvas.setVisible(not use_gpu)
+		if self._gpu_canvas is not None:
+			self._gpu_canvas.native.setVisible(use_gpu)
+		if use_gpu:
+			# Matplotlib sizes are areas in points^2, vispy sizes are diameters in pixels
+			color_index = np.clip((closeness * STAR_COLOR_LEVELS).astype(np.int32), 0, STAR_COLOR_LEVELS - 1)
+			self._gpu_stars.set_data(pos=xyz[:, :2], face_color=STAR_COLOR_LUT[color_index],
+				size=np.sqrt(star_sizes), edge_width=0)
+			self._gpu_view.camera.set_range(x=(-max_distance_pc, max_distance_pc), y=(-max_distance_pc, max_distance_pc))
+			self._gpu_canvas.update()
+			return
+		
+		density = None
+		if len(x) > DATASHADER_THRESHOLD:
+			density = _aggregate_stars(x, y, distances, max_distance_pc)
+		
+		# Update the existing artists in place rather than recreating them
+		if density is None:
+			self._star_plot.set_offsets(xyz[:, :2])
+			self._star_plot.set_sizes(star_sizes)
+			self._star_plot.set_rasterized(len(x) > RASTERIZE_THRESHOLD)
+			self._star_plot.set_array(distances)
+		else:
+			self._star_image.set_data(density)
+			self._star_image.set_extent((-max_distance_pc, max_distance_pc, -max_distance_pc, max_distance_pc))
+		self._star_plot.set_visible(density is None)
+		self._star_image.set_visible(density is not None)
+		self._star_plot.set_clim(min_distance, min_distance + distance_span)
+		self._star_image.set_clim(min_distance, min_distance + distance_span)
+		self._cbar.update_normal(self._star_plot)
+		
+		# Set the limits and title for the plot; everything else was styled once up front
+		self.ax.set_xlim(-max_distance_pc, max_distance_pc)
+		self.ax.set_ylim(-max_distance_pc, max_distance_pc)
+		self.ax.set_title(f'Nearby Stars within {max_distance_ly:.2f} lyr ({max_distance_pc:.2f} pc)', color='white', fontsize=16)
+		
+		# Redraw the canvas once Qt is idle
+		self.canvas.draw_idle()
 		
 if __name__ == '__main__':
 	app = QApplication(sys.argv)